@@ -3,7 +3,10 @@ from dotenv import load_dotenv
 import os
 import weaviate
 from groq import Groq
-from .services import setup_weaviate_schema
+from .services import setup_weaviate_schema, load_tombstones
+from .auth import init_auth
+from .tombstones import TombstoneSet, start_compactor, start_tombstone_refresher
+from .prompts import UsageRecorder, parse_template_weights, load_tokenizer
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,7 +22,13 @@ weaviate_client = weaviate.connect_to_local(
 def create_app():
     """Create and configure an instance of the Flask application."""
     app = Flask(__name__)
-    app.secret_key = os.urandom(24)
+
+    # Authentication: "session" (cookie), "token" (signed bearer tokens) or "both".
+    # AUTH_SECRET_KEYS is a comma-separated list, newest first, shared by every worker.
+    app.config['AUTH_MODE'] = os.getenv("AUTH_MODE", "both").lower()
+    app.config['AUTH_SECRET_KEYS'] = os.getenv("AUTH_SECRET_KEYS", "").split(",")
+    app.config['AUTH_TOKEN_TTL'] = int(os.getenv("AUTH_TOKEN_TTL", "86400"))
+    init_auth(app)
 
     # Make clients available to the app context
     app.weaviate_client = weaviate_client
@@ -28,6 +37,33 @@ def create_app():
     # Define constants
     app.config['UPLOAD_FOLDER'] = os.getenv("UPLOAD_FOLDER", "./uploads")
     app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'docx', 'txt', 'json'}
+    # Ingest-time document digests: "off", "local" (deterministic parser) or "llm" (parser + LLM refinement)
+    app.config['DIGEST_MODE'] = os.getenv("DIGEST_MODE", "local").lower()
+    # Number of raw chunks sent alongside digests when generating a resume
+    app.config['DIGEST_CONTEXT_CHUNKS'] = int(os.getenv("DIGEST_CONTEXT_CHUNKS", "8"))
+    # How often each process re-reads tombstones written by other workers
+    app.config['TOMBSTONE_REFRESH_INTERVAL'] = float(os.getenv("TOMBSTONE_REFRESH_INTERVAL", "2"))
+    # Background compaction of tombstoned (deleted) documents. Only one process per host
+    # compacts (lock file in UPLOAD_FOLDER); on multi-node deployments enable it on one node.
+    app.config['COMPACTION_ENABLED'] = os.getenv("COMPACTION_ENABLED", "true").lower() == "true"
+    app.config['COMPACTION_INTERVAL'] = float(os.getenv("COMPACTION_INTERVAL", "30"))
+    app.config['COMPACTION_BATCH_SIZE'] = int(os.getenv("COMPACTION_BATCH_SIZE", "100"))
+    app.config['COMPACTION_BATCH_PAUSE'] = float(os.getenv("COMPACTION_BATCH_PAUSE", "0.5"))
+    app.config['ORPHAN_UPLOAD_MAX_AGE'] = float(os.getenv("ORPHAN_UPLOAD_MAX_AGE", "3600"))
+    # Resume prompt templates ("v1:50,v2:50" splits users between versions) and completion sizing
+    app.config['PROMPT_TEMPLATE_WEIGHTS'] = parse_template_weights(os.getenv("PROMPT_TEMPLATE_WEIGHTS", "v1:1"))
+    app.config['LLM_MIN_COMPLETION_TOKENS'] = int(os.getenv("LLM_MIN_COMPLETION_TOKENS", "1536"))
+    # gpt-oss is a reasoning model: its reasoning tokens are billed against max_tokens too
+    app.config['LLM_REASONING_TOKENS'] = int(os.getenv("LLM_REASONING_TOKENS", "2048"))
+    # Upper bound for the adaptive budget, also used to retry a truncated response once
+    app.config['LLM_MAX_COMPLETION_TOKENS'] = int(os.getenv("LLM_MAX_COMPLETION_TOKENS", "8192"))
+    app.config['LLM_CONTEXT_WINDOW'] = int(os.getenv("LLM_CONTEXT_WINDOW", "131072"))
+    load_tokenizer()
+
+    # Per-request LLM token usage; optionally appended as JSON lines to LLM_USAGE_LOG
+    app.llm_usage = UsageRecorder(log_path=os.getenv("LLM_USAGE_LOG"))
+    # /llm-usage is operator data; it is only served when this key is set and sent as X-Admin-Key
+    app.config['LLM_USAGE_ADMIN_KEY'] = os.getenv("LLM_USAGE_ADMIN_KEY", "")
 
     # Create upload folder if it doesn't exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -42,4 +78,17 @@ def create_app():
         setup_weaviate_schema(weaviate_client)
         print("Schema setup complete.")
 
+        # Load pending deletes so tombstoned documents are hidden immediately
+        app.tombstones = TombstoneSet(load_tombstones(weaviate_client, routes.TOMBSTONE_COLLECTION))
+        start_tombstone_refresher(
+            weaviate_client, app.tombstones, routes.TOMBSTONE_COLLECTION, app.config['TOMBSTONE_REFRESH_INTERVAL']
+        )
+        if app.config['COMPACTION_ENABLED']:
+            start_compactor(weaviate_client, app.tombstones, {
+                **app.config,
+                'DOCUMENT_COLLECTION': routes.DOCUMENT_COLLECTION,
+                'DIGEST_COLLECTION': routes.DIGEST_COLLECTION,
+                'TOMBSTONE_COLLECTION': routes.TOMBSTONE_COLLECTION
+            })
+
     return app
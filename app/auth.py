@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request, session
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+TOKEN_SALT = "ats-llm-service.auth-token"
+VERIFY_CACHE_SIZE = 10000
+AUTH_MODES = ('session', 'token', 'both')
+
+# token -> (identity, expires_at). Tokens are immutable, so a verified token stays
+# valid until its expiry and repeat requests skip the HMAC check entirely.
+_verify_cache = OrderedDict()
+_verify_cache_lock = threading.Lock()
+
+# ==============================================================================
+# SETUP
+# ==============================================================================
+
+def init_auth(app):
+    """Configure shared signing keys for bearer tokens and cookie sessions"""
+    if app.config['AUTH_MODE'] not in AUTH_MODES:
+        raise ValueError(f"Invalid AUTH_MODE {app.config['AUTH_MODE']!r}; expected one of {', '.join(AUTH_MODES)}")
+
+    keys = [k.strip() for k in app.config['AUTH_SECRET_KEYS'] if k.strip()]
+    if not keys:
+        print("WARNING: AUTH_SECRET_KEYS is not set; using a per-process key. "
+              "Tokens and sessions will not survive restarts or work across workers.")
+        keys = [os.urandom(24).hex()]
+    app.config['AUTH_SECRET_KEYS'] = keys
+
+    # The first key signs, older keys are still accepted so they can be rotated out
+    app.secret_key = keys[0]
+    app.config['SECRET_KEY_FALLBACKS'] = keys[1:]
+    # itsdangerous signs with the last key in the list and verifies against all of them
+    app.token_serializer = URLSafeTimedSerializer(list(reversed(keys)), salt=TOKEN_SALT)
+
+# ==============================================================================
+# TOKENS
+# ==============================================================================
+
+def issue_token(user):
+    """Create a signed, expiring bearer token for a user"""
+    token = current_app.token_serializer.dumps({"uid": user['user_id'], "name": user['username']})
+    return {
+        "access_token": token,
+        "token_type": "Bearer",
+        "expires_in": current_app.config['AUTH_TOKEN_TTL']
+    }
+
+def verify_token(token):
+    """Return the identity stored in a token, or None if it is invalid or expired"""
+    now = time.time()
+    with _verify_cache_lock:
+        cached = _verify_cache.get(token)
+        if cached is not None:
+            identity, expires_at = cached
+            if now < expires_at:
+                _verify_cache.move_to_end(token)
+                return identity
+            del _verify_cache[token]
+
+    ttl = current_app.config['AUTH_TOKEN_TTL']
+    try:
+        payload, signed_at = current_app.token_serializer.loads(token, max_age=ttl, return_timestamp=True)
+    except BadSignature:
+        return None
+
+    identity = {"user_id": payload.get("uid"), "username": payload.get("name")}
+    with _verify_cache_lock:
+        _verify_cache[token] = (identity, signed_at.timestamp() + ttl)
+        if len(_verify_cache) > VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+    return identity
+
+# ==============================================================================
+# REQUEST HELPERS
+# ==============================================================================
+
+def get_current_user():
+    """Resolve the caller from a bearer token or the cookie session, depending on AUTH_MODE"""
+    mode = current_app.config['AUTH_MODE']
+
+    auth_header = request.headers.get('Authorization', '')
+    if mode in ('token', 'both') and auth_header.startswith('Bearer '):
+        return verify_token(auth_header[len('Bearer '):].strip())
+
+    if mode in ('session', 'both') and 'user_id' in session:
+        return {"user_id": session['user_id'], "username": session.get('username')}
+    return None
+
+def login_user(user):
+    """Start a cookie session and/or issue a token; returns extra fields for the response"""
+    mode = current_app.config['AUTH_MODE']
+    if mode in ('session', 'both'):
+        session['user_id'] = user['user_id']
+        session['username'] = user['username']
+    if mode in ('token', 'both'):
+        return issue_token(user)
+    return {}
+
+def logout_user():
+    # Bearer tokens are stateless; clients log out by discarding them
+    session.clear()
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import threading
+from collections import deque
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a character-based estimate
+    tiktoken = None
+
+# ==============================================================================
+# RESUME PROMPT TEMPLATES
+# ==============================================================================
+# Each template is split into a static system prefix (instructions + JSON schema)
+# and a variable user message (candidate data + job description). The prefix is
+# sent first and must stay byte-identical between requests so provider-side
+# prompt caching can reuse it: never format request data into it.
+
+RESUME_SCHEMA = """{
+  "SUMMARY": "A 2-3 sentence professional summary.",
+  "SKILLS": {
+    "Languages": "Comma-separated list.", "AI_ML": "Comma-separated list.", "Tools": "Comma-separated list.",
+    "Database": "Comma-separated list.", "Cloud": "Comma-separated list.", "Web_Development": "Comma-separated list.",
+    "Certifications": "Comma-separated list."
+  },
+  "WORK_EXPERIENCE": [{
+      "Company": "Company Name", "Location": "City, State", "Title": "Job Title",
+      "Dates": "Month Year - Month Year", "Bullets": ["Achievement-focused bullet point."]
+  }],
+  "EDUCATION": [{
+      "Degree": "Degree and Major", "University": "University Name",
+      "Relevant_Courses": ["Course 1"], "GPA": "X.X/4.0", "Dates": "Month Year"
+  }],
+  "PROJECTS": [{
+      "Name": "Project Name", "Technologies": "Comma-separated list.",
+      "Bullets": ["Description of project."], "Live_Demo": "URL"
+  }]
+}"""
+
+PROMPT_TEMPLATES = {
+    "v1": {
+        "system": f"""You are a professional resume writer creating an ATS-optimized resume in JSON format.
+Use ONLY the provided "Candidate Data" to fill out the JSON structure. Do not invent information.
+Tailor the content to the "Target Job Description". If no data exists for a field, use an empty string or array.
+Your entire output must be a single, valid JSON object.
+
+**Required JSON Output Structure:**
+{RESUME_SCHEMA}
+""",
+        "user": """**Candidate Data:**
+---
+{context}
+---
+
+**Target Job Description:**
+---
+{job_description}
+---
+"""
+    },
+    # Compact variant: minified schema and terser instructions for latency A/B tests
+    "v2": {
+        "system": f"""Write an ATS-optimized resume as a single valid JSON object.
+Use only the candidate data; never invent facts. Tailor wording to the job description.
+Use "" or [] for fields without data. Keep bullets concise and achievement-focused.
+Schema: {json.dumps(json.loads(RESUME_SCHEMA), separators=(',', ':'))}
+""",
+        "user": """CANDIDATE DATA:
+{context}
+
+JOB DESCRIPTION:
+{job_description}
+"""
+    }
+}
+
+DEFAULT_TEMPLATE_VERSION = "v1"
+
+def build_resume_messages(version, context, job_description):
+    """Return chat messages with the static prefix first and request data last"""
+    template = PROMPT_TEMPLATES[version]
+    return [
+        {"role": "system", "content": template["system"]},
+        {"role": "user", "content": template["user"].format(context=context, job_description=job_description)}
+    ]
+
+def parse_template_weights(spec):
+    """Parse "v1:70,v2:30" into {"v1": 70, "v2": 30}, ignoring unknown versions and non-positive weights"""
+    weights = {}
+    for part in spec.split(","):
+        version, _, weight = part.strip().partition(":")
+        if version not in PROMPT_TEMPLATES:
+            continue
+        try:
+            weight = int(weight or 1)
+        except ValueError:
+            raise ValueError(f"Invalid weight for prompt template {version!r}: {weight!r}")
+        if weight > 0:
+            weights[version] = weight
+    return weights or {DEFAULT_TEMPLATE_VERSION: 1}
+
+def select_template_version(user_id, weights, override=None):
+    """Pick a template version, sticky per user so A/B groups stay stable.
+
+    Returns (version, assignment) where assignment is "override" for an explicitly
+    requested version, so those requests can be kept out of the A/B comparison.
+    """
+    if isinstance(override, str) and override in PROMPT_TEMPLATES:
+        return override, "override"
+    return _weighted_version(user_id, weights), "ab"
+
+def _weighted_version(user_id, weights):
+    total = sum(weights.values())
+    bucket = int(hashlib.sha256(user_id.encode()).hexdigest(), 16) % total
+    for version, weight in sorted(weights.items()):
+        if bucket < weight:
+            return version
+        bucket -= weight
+    return DEFAULT_TEMPLATE_VERSION
+
+# ==============================================================================
+# LOCAL TOKEN ACCOUNTING
+# ==============================================================================
+
+_encoding = None
+
+def load_tokenizer():
+    """Load the tokenizer once at startup; tiktoken may download its BPE file on first use.
+
+    Requests never trigger that download: until (or unless) this succeeds,
+    count_tokens uses the character estimate.
+    """
+    global _encoding
+    if tiktoken is None:
+        print("tiktoken is not installed, estimating token counts")
+        return
+    try:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Could not load tokenizer, estimating token counts: {e}")
+
+def count_tokens(text):
+    """Count tokens locally; approximates ~4 characters per token without tiktoken"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def count_message_tokens(messages):
+    # A few tokens of per-message framing on top of the content
+    return sum(count_tokens(message["content"]) + 4 for message in messages)
+
+def completion_budget(prompt_tokens, context_tokens, min_tokens, max_tokens, context_window):
+    """Size max_tokens from the candidate data instead of always asking for the maximum"""
+    budget = min_tokens + context_tokens
+    return max(1, min(budget, max_tokens, context_window - prompt_tokens))
+
+# ==============================================================================
+# USAGE RECORDING
+# ==============================================================================
+
+class UsageRecorder:
+    """Per-request prompt/completion token usage, aggregated by template version.
+
+    A/B-assigned requests and explicit overrides are aggregated separately.
+    """
+
+    def __init__(self, log_path=None, history=1000):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=history)
+        self._totals = {}
+        self._log_path = log_path
+
+    def record(self, entry):
+        with self._lock:
+            self._recent.append(entry)
+            key = (entry.get("assignment", "ab"), entry["template_version"])
+            totals = self._totals.setdefault(key, {
+                "requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "cached_prompt_tokens": 0, "latency_ms": 0.0
+            })
+            totals["requests"] += 1
+            if entry.get("status") != "ok":
+                totals["errors"] += 1
+            for field in ("prompt_tokens", "completion_tokens", "cached_prompt_tokens", "latency_ms"):
+                totals[field] += entry.get(field) or 0
+
+            if self._log_path:
+                # Usage logging must never change the outcome of the request being recorded
+                try:
+                    with open(self._log_path, "a") as f:
+                        f.write(json.dumps(entry) + "\n")
+                except OSError as e:
+                    print(f"Could not write LLM usage log {self._log_path}: {e}")
+
+    def summary(self):
+        with self._lock:
+            by_version = {"ab": {}, "override": {}}
+            for (assignment, version), totals in self._totals.items():
+                requests = totals["requests"]
+                by_version.setdefault(assignment, {})[version] = {
+                    **totals,
+                    "avg_prompt_tokens": totals["prompt_tokens"] / requests,
+                    "avg_completion_tokens": totals["completion_tokens"] / requests,
+                    "avg_latency_ms": totals["latency_ms"] / requests
+                }
+            return {
+                "by_template_version": by_version["ab"],
+                "overrides": by_version["override"],
+                "recent": list(self._recent)[-20:]
+            }
@@ -1,22 +1,27 @@
-from flask import Blueprint, request, jsonify, session, current_app
+from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
 import os
+import hmac
 import json
 import uuid
 from datetime import datetime
 
 from .services import (
     find_user_by_email, add_user, process_and_store_document, 
-    get_user_documents_summary, delete_document_by_id, search_user_documents,
-    generate_resume_from_context, get_user_stats
+    get_user_documents_summary, document_exists, add_tombstone, search_user_documents,
+    generate_resume_from_context, get_user_stats, get_user_digests, get_user_document_ids
 )
 from .utils import allowed_file
+from .auth import get_current_user, login_user, logout_user
+from .prompts import select_template_version
 
 # Create a Blueprint
 main_bp = Blueprint('main', __name__)
 
 USER_COLLECTION = "Users"
 DOCUMENT_COLLECTION = "UserDocuments"
+DIGEST_COLLECTION = "DocumentDigests"
+TOMBSTONE_COLLECTION = "DocumentTombstones"
 
 # ==================== USER MANAGEMENT ====================
 
@@ -39,13 +44,13 @@ def register():
     if not user:
         return jsonify({"error": "Registration failed"}), 500
         
-    session['user_id'] = user['user_id']
-    session['username'] = user['username']
+    token = login_user(user)
     
     return jsonify({
         "message": "User registered successfully",
         "user_id": user['user_id'],
-        "username": user['username']
+        "username": user['username'],
+        **token
     }), 201
 
 @main_bp.route('/login', methods=['POST'])
@@ -63,27 +68,28 @@ def login():
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    session['user_id'] = user['user_id']
-    session['username'] = user['username']
+    token = login_user(user)
     
-    return jsonify({"message": "Login successful", **user}), 200
+    return jsonify({"message": "Login successful", **user, **token}), 200
 
 @main_bp.route('/logout', methods=['POST'])
 def logout():
-    session.clear()
+    logout_user()
     return jsonify({"message": "Logged out successfully"}), 200
 
 @main_bp.route('/current-user', methods=['GET'])
 def current_user():
-    if 'user_id' not in session:
+    user = get_current_user()
+    if not user:
         return jsonify({"error": "Not logged in"}), 401
-    return jsonify({"user_id": session['user_id'], "username": session['username']}), 200
+    return jsonify({"user_id": user['user_id'], "username": user['username']}), 200
 
 # ==================== DOCUMENT MANAGEMENT ====================
 
 @main_bp.route('/upload-document', methods=['POST'])
 def upload_document():
-    if 'user_id' not in session:
+    user = get_current_user()
+    if not user:
         return jsonify({"error": "Not logged in"}), 401
     if 'file' not in request.files:
         return jsonify({"error": "No file provided"}), 400
@@ -92,7 +98,7 @@ def upload_document():
     if file.filename == '' or not allowed_file(file.filename, current_app.config['ALLOWED_EXTENSIONS']):
         return jsonify({"error": "Invalid file or file type"}), 400
 
-    user_id = session['user_id']
+    user_id = user['user_id']
     filename = secure_filename(file.filename)
     file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{user_id}_{filename}")
     file.save(file_path)
@@ -108,7 +114,11 @@ def upload_document():
             file_path=file_path,
             filename=filename,
             category=category,
-            metadata_str=metadata_str
+            metadata_str=metadata_str,
+            digest_collection_name=DIGEST_COLLECTION,
+            digest_mode=current_app.config['DIGEST_MODE'],
+            groq_client=current_app.groq_client,
+            reasoning_tokens=current_app.config['LLM_REASONING_TOKENS']
         )
         return jsonify(result), 201
     except Exception as e:
@@ -119,40 +129,43 @@ def upload_document():
 
 @main_bp.route('/my-documents', methods=['GET'])
 def my_documents():
-    if 'user_id' not in session:
+    user = get_current_user()
+    if not user:
         return jsonify({"error": "Not logged in"}), 401
     
     documents = get_user_documents_summary(
         client=current_app.weaviate_client,
         collection_name=DOCUMENT_COLLECTION,
-        user_id=session['user_id']
+        user_id=user['user_id'],
+        excluded_document_ids=current_app.tombstones.for_user(user['user_id'])
     )
     return jsonify({"documents": documents, "total": len(documents)}), 200
 
 @main_bp.route('/delete-document/<document_id>', methods=['DELETE'])
 def delete_document(document_id):
-    if 'user_id' not in session:
+    user = get_current_user()
+    if not user:
         return jsonify({"error": "Not logged in"}), 401
     
-    response = delete_document_by_id(
-        client=current_app.weaviate_client,
-        collection_name=DOCUMENT_COLLECTION,
-        user_id=session['user_id'],
-        document_id=document_id
-    )
-    
-    if response.successful == 0 and response.failed == 0:
-         return jsonify({"error": "Document not found"}), 404
+    client = current_app.weaviate_client
+    user_id = user['user_id']
+    if current_app.tombstones.contains(user_id, document_id) or \
+            not document_exists(client, DOCUMENT_COLLECTION, user_id, document_id):
+        return jsonify({"error": "Document not found"}), 404
+
+    # Record a tombstone and return; the background compactor does the physical delete
+    add_tombstone(client, TOMBSTONE_COLLECTION, user_id, document_id)
+    current_app.tombstones.add(user_id, document_id)
     
     return jsonify({
         "message": "Document deletion initiated",
-        "successful_deletes": response.successful,
-        "failed_deletes": response.failed
-    }), 200
+        "document_id": document_id
+    }), 202
 
 @main_bp.route('/search-my-documents', methods=['POST'])
 def search_my_documents():
-    if 'user_id' not in session:
+    user = get_current_user()
+    if not user:
         return jsonify({"error": "Not logged in"}), 401
 
     data = request.get_json()
@@ -163,10 +176,11 @@ def search_my_documents():
     results = search_user_documents(
         client=current_app.weaviate_client,
         collection_name=DOCUMENT_COLLECTION,
-        user_id=session['user_id'],
+        user_id=user['user_id'],
         query=query,
         limit=data.get('limit', 20),
-        category_filter=data.get('category')
+        category_filter=data.get('category'),
+        excluded_document_ids=current_app.tombstones.for_user(user['user_id'])
     )
     return jsonify({"results": results, "count": len(results)}), 200
 
@@ -174,7 +188,8 @@ def search_my_documents():
 
 @main_bp.route('/generate-resume', methods=['POST'])
 def generate_resume():
-    if 'user_id' not in session:
+    user = get_current_user()
+    if not user:
         return jsonify({"error": "Not logged in"}), 401
     
     data = request.get_json()
@@ -182,24 +197,57 @@ def generate_resume():
     if not job_description:
         return jsonify({"error": "Job description is required"}), 400
 
-    # 1. Fetch relevant context from Weaviate
+    # 1. Fetch relevant context from Weaviate: document digests plus a few top chunks,
+    # falling back to a wide chunk search if any document was ingested without a digest
+    deleted_ids = current_app.tombstones.for_user(user['user_id'])
+    digests = []
+    if current_app.config['DIGEST_MODE'] != 'off':
+        digests = get_user_digests(
+            client=current_app.weaviate_client,
+            collection_name=DIGEST_COLLECTION,
+            user_id=user['user_id'],
+            excluded_document_ids=deleted_ids
+        )
+
+    all_digested = False
+    if digests:
+        document_ids = get_user_document_ids(
+            client=current_app.weaviate_client,
+            collection_name=DOCUMENT_COLLECTION,
+            user_id=user['user_id'],
+            excluded_document_ids=deleted_ids
+        )
+        all_digested = document_ids <= {d["document_id"] for d in digests}
+
     relevant_chunks = search_user_documents(
         client=current_app.weaviate_client,
         collection_name=DOCUMENT_COLLECTION,
-        user_id=session['user_id'],
+        user_id=user['user_id'],
         query=job_description,
-        limit=30
+        limit=current_app.config['DIGEST_CONTEXT_CHUNKS'] if all_digested else 30,
+        excluded_document_ids=deleted_ids
     )
     
-    if not relevant_chunks:
+    if not relevant_chunks and not digests:
         return jsonify({"error": "No relevant documents found to build a resume."}), 404
         
     # 2. Generate resume using Groq
+    template_version, assignment = select_template_version(
+        user['user_id'], current_app.config['PROMPT_TEMPLATE_WEIGHTS'], override=data.get('template_version')
+    )
     try:
-        resume_json = generate_resume_from_context(
+        resume_json, usage = generate_resume_from_context(
             groq_client=current_app.groq_client,
             relevant_chunks=relevant_chunks,
-            job_description=job_description
+            job_description=job_description,
+            digests=digests,
+            template_version=template_version,
+            assignment=assignment,
+            min_completion_tokens=current_app.config['LLM_MIN_COMPLETION_TOKENS'],
+            reasoning_tokens=current_app.config['LLM_REASONING_TOKENS'],
+            max_completion_tokens=current_app.config['LLM_MAX_COMPLETION_TOKENS'],
+            context_window=current_app.config['LLM_CONTEXT_WINDOW'],
+            record_usage=current_app.llm_usage.record
         )
     except Exception as e:
         return jsonify({"error": f"Failed to generate resume: {str(e)}"}), 500
@@ -209,8 +257,11 @@ def generate_resume():
         "resume": resume_json,
         "metadata": {
             "generated_at": datetime.now().isoformat(),
-            "user_id": session['user_id'],
-            "sources_used": len(relevant_chunks)
+            "user_id": user['user_id'],
+            "sources_used": len(relevant_chunks),
+            "digests_used": len(digests),
+            "template_version": template_version,
+            "usage": usage
         }
     }), 200
 
@@ -227,16 +278,27 @@ def health():
 
 @main_bp.route('/stats', methods=['GET'])
 def stats():
-    if 'user_id' not in session:
+    user = get_current_user()
+    if not user:
         return jsonify({"error": "Not logged in"}), 401
         
     statistics = get_user_stats(
         client=current_app.weaviate_client,
         collection_name=DOCUMENT_COLLECTION,
-        user_id=session['user_id']
+        user_id=user['user_id'],
+        excluded_document_ids=current_app.tombstones.for_user(user['user_id'])
     )
     return jsonify({
-        "user_id": session['user_id'],
-        "username": session.get('username'),
+        "user_id": user['user_id'],
+        "username": user['username'],
         **statistics
     }), 200
+
+@main_bp.route('/llm-usage', methods=['GET'])
+def llm_usage():
+    admin_key = current_app.config['LLM_USAGE_ADMIN_KEY']
+    if not admin_key:
+        return jsonify({"error": "Not found"}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Key', '').encode(), admin_key.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(current_app.llm_usage.summary()), 200
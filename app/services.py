@@ -1,13 +1,18 @@
 import weaviate
 from weaviate.classes.config import Property, DataType, Configure
 from weaviate.classes.query import Filter, MetadataQuery
+from weaviate.classes.aggregate import GroupByAggregate
 import hashlib
+import time
 from datetime import datetime
 import pypdf
 import docx
 import json
 import uuid
-from .utils import chunk_text, categorize_content
+from .prompts import (
+    DEFAULT_TEMPLATE_VERSION, build_resume_messages, count_tokens, count_message_tokens, completion_budget
+)
+from .utils import chunk_text, categorize_content, extract_document_digest, format_digest, DIGEST_LIMITS
 
 # ==============================================================================
 # FILE PROCESSING SERVICE
@@ -91,6 +96,40 @@ def setup_weaviate_schema(client: weaviate.WeaviateClient):
         )
         print(f"Created collection: {doc_collection}")
 
+    digest_collection = "DocumentDigests"
+    if digest_collection not in collection_names:
+        client.collections.create(
+            name=digest_collection,
+            vectorizer_config=Configure.Vectorizer.none(),
+            properties=[
+                Property(name="user_id", data_type=DataType.TEXT),
+                Property(name="document_id", data_type=DataType.TEXT),
+                Property(name="filename", data_type=DataType.TEXT),
+                Property(name="digest", data_type=DataType.TEXT),
+                Property(name="uploaded_at", data_type=DataType.TEXT)
+            ]
+        )
+        print(f"Created collection: {digest_collection}")
+
+    tombstone_collection = "DocumentTombstones"
+    if tombstone_collection not in collection_names:
+        client.collections.create(
+            name=tombstone_collection,
+            vectorizer_config=Configure.Vectorizer.none(),
+            properties=[
+                Property(name="user_id", data_type=DataType.TEXT),
+                Property(name="document_id", data_type=DataType.TEXT),
+                Property(name="deleted_at", data_type=DataType.TEXT)
+            ]
+        )
+        print(f"Created collection: {tombstone_collection}")
+
+
+def exclude_documents(filters, document_ids):
+    """Narrow a filter so it skips the given (tombstoned) document_ids"""
+    for document_id in document_ids or ():
+        filters = filters & Filter.by_property("document_id").not_equal(document_id)
+    return filters
 
 def find_user_by_email(client: weaviate.WeaviateClient, collection_name: str, email: str):
     collection = client.collections.get(collection_name)
@@ -113,7 +152,9 @@ def add_user(client: weaviate.WeaviateClient, collection_name: str, username: st
     })
     return {"user_id": user_id, "username": username}
 
-def process_and_store_document(client: weaviate.WeaviateClient, collection_name: str, user_id: str, file_path: str, filename: str, category: str, metadata_str: str):
+def process_and_store_document(client: weaviate.WeaviateClient, collection_name: str, user_id: str, file_path: str, filename: str, category: str, metadata_str: str,
+                               digest_collection_name: str = None, digest_mode: str = "off", groq_client=None,
+                               reasoning_tokens: int = 2048):
     text = extract_text_from_file(file_path, filename)
     if not text.strip():
         raise ValueError("Could not extract text from file or file is empty.")
@@ -139,17 +180,74 @@ def process_and_store_document(client: weaviate.WeaviateClient, collection_name:
     if objects_to_insert:
         collection.data.insert_many(objects_to_insert)
 
+    # Optional ingest stage: precompute a compact digest so generation doesn't
+    # have to rebuild the candidate profile from raw overlapping chunks.
+    digest_created = False
+    if digest_collection_name and digest_mode in ("local", "llm"):
+        digest = extract_document_digest(text)
+        if digest_mode == "llm" and groq_client is not None:
+            digest = refine_digest_with_llm(groq_client, text, digest, reasoning_tokens=reasoning_tokens)
+        try:
+            store_document_digest(client, digest_collection_name, user_id, document_id, filename, digest)
+            digest_created = True
+        except Exception as e:
+            # The chunks are already stored; keep the document and let generation fall back to them
+            print(f"Storing digest for {filename} failed, continuing without it: {e}")
+
     return {
         "message": "Document uploaded successfully",
         "document_id": document_id,
         "filename": filename,
-        "chunks_created": len(objects_to_insert)
+        "chunks_created": len(objects_to_insert),
+        "digest_created": digest_created
     }
 
-def get_user_documents_summary(client: weaviate.WeaviateClient, collection_name: str, user_id: str):
+def store_document_digest(client: weaviate.WeaviateClient, collection_name: str, user_id: str, document_id: str, filename: str, digest: dict):
+    collection = client.collections.get(collection_name)
+    collection.data.insert({
+        "user_id": user_id,
+        "document_id": document_id,
+        "filename": filename,
+        "digest": json.dumps(digest),
+        "uploaded_at": datetime.now().isoformat()
+    })
+
+def get_user_document_ids(client: weaviate.WeaviateClient, collection_name: str, user_id: str, excluded_document_ids=None):
+    """Return the distinct document_ids a user has stored chunks for"""
+    collection = client.collections.get(collection_name)
+    response = collection.aggregate.over_all(
+        filters=exclude_documents(Filter.by_property("user_id").equal(user_id), excluded_document_ids),
+        group_by=GroupByAggregate(prop="document_id"),
+        total_count=True
+    )
+    return {group.grouped_by.value for group in response.groups}
+
+def get_user_digests(client: weaviate.WeaviateClient, collection_name: str, user_id: str, limit: int = 50, excluded_document_ids=None):
     collection = client.collections.get(collection_name)
     result = collection.query.fetch_objects(
-        filters=Filter.by_property("user_id").equal(user_id), limit=1000
+        filters=exclude_documents(Filter.by_property("user_id").equal(user_id), excluded_document_ids),
+        limit=limit
+    )
+
+    digests = []
+    for obj in result.objects:
+        props = obj.properties
+        try:
+            digest = json.loads(props.get("digest") or "{}")
+        except json.JSONDecodeError:
+            continue
+        digests.append({
+            "document_id": props.get("document_id"),
+            "filename": props.get("filename"),
+            "digest": digest
+        })
+    return digests
+
+def get_user_documents_summary(client: weaviate.WeaviateClient, collection_name: str, user_id: str, excluded_document_ids=None):
+    collection = client.collections.get(collection_name)
+    result = collection.query.fetch_objects(
+        filters=exclude_documents(Filter.by_property("user_id").equal(user_id), excluded_document_ids),
+        limit=1000
     )
     
     documents = {}
@@ -170,15 +268,65 @@ def get_user_documents_summary(client: weaviate.WeaviateClient, collection_name:
         for doc in documents.values()
     ]
 
-def delete_document_by_id(client: weaviate.WeaviateClient, collection_name: str, user_id: str, document_id: str):
+def document_exists(client: weaviate.WeaviateClient, collection_name: str, user_id: str, document_id: str):
+    collection = client.collections.get(collection_name)
+    result = collection.query.fetch_objects(
+        filters=(Filter.by_property("user_id").equal(user_id) & Filter.by_property("document_id").equal(document_id)),
+        limit=1, return_properties=[]
+    )
+    return bool(result.objects)
+
+def add_tombstone(client: weaviate.WeaviateClient, collection_name: str, user_id: str, document_id: str):
     collection = client.collections.get(collection_name)
-    return collection.data.delete_many(
+    collection.data.insert({
+        "user_id": user_id,
+        "document_id": document_id,
+        "deleted_at": datetime.now().isoformat()
+    })
+
+def load_tombstones(client: weaviate.WeaviateClient, collection_name: str):
+    """Return all pending tombstones as {user_id: {document_id, ...}}"""
+    collection = client.collections.get(collection_name)
+    tombstones = {}
+    for obj in collection.iterator(return_properties=["user_id", "document_id"]):
+        user_id = obj.properties.get("user_id")
+        tombstones.setdefault(user_id, set()).add(obj.properties.get("document_id"))
+    return tombstones
+
+def remove_tombstone(client: weaviate.WeaviateClient, collection_name: str, user_id: str, document_id: str):
+    collection = client.collections.get(collection_name)
+    collection.data.delete_many(
         where=(Filter.by_property("user_id").equal(user_id) & Filter.by_property("document_id").equal(document_id))
     )
 
-def search_user_documents(client: weaviate.WeaviateClient, collection_name: str, user_id: str, query: str, limit: int, category_filter: str = None):
+def compact_document(client: weaviate.WeaviateClient, collection_name: str, user_id: str, document_id: str,
+                     batch_size: int = 100, batch_pause: float = 0.5, digest_collection_name: str = None):
+    """Physically delete a tombstoned document in small batches; returns the number of chunks removed"""
+    where = Filter.by_property("user_id").equal(user_id) & Filter.by_property("document_id").equal(document_id)
     collection = client.collections.get(collection_name)
-    filters = Filter.by_property("user_id").equal(user_id)
+
+    deleted = 0
+    while True:
+        batch = collection.query.fetch_objects(filters=where, limit=batch_size, return_properties=[])
+        if not batch.objects:
+            break
+        response = collection.data.delete_many(
+            where=Filter.by_id().contains_any([obj.uuid for obj in batch.objects])
+        )
+        # A batch already removed by someone else counts as progress; only real failures abort
+        deleted += response.successful
+        if response.failed:
+            raise RuntimeError(f"Could not delete {response.failed} chunks of document {document_id}")
+        # Throttle so compaction doesn't starve ingestion and HNSW indexing
+        time.sleep(batch_pause)
+
+    if digest_collection_name:
+        client.collections.get(digest_collection_name).data.delete_many(where=where)
+    return deleted
+
+def search_user_documents(client: weaviate.WeaviateClient, collection_name: str, user_id: str, query: str, limit: int, category_filter: str = None, excluded_document_ids=None):
+    collection = client.collections.get(collection_name)
+    filters = exclude_documents(Filter.by_property("user_id").equal(user_id), excluded_document_ids)
     if category_filter:
         filters = filters & Filter.by_property("category").equal(category_filter)
     
@@ -199,15 +347,16 @@ def search_user_documents(client: weaviate.WeaviateClient, collection_name: str,
         })
     return results
 
-def get_user_stats(client: weaviate.WeaviateClient, collection_name: str, user_id: str):
+def get_user_stats(client: weaviate.WeaviateClient, collection_name: str, user_id: str, excluded_document_ids=None):
     collection = client.collections.get(collection_name)
+    filters = exclude_documents(Filter.by_property("user_id").equal(user_id), excluded_document_ids)
     agg_response = collection.aggregate.over_all(
-        filters=Filter.by_property("user_id").equal(user_id),
+        filters=filters,
         total_count=True
     )
     
     query_response = collection.query.fetch_objects(
-        filters=Filter.by_property("user_id").equal(user_id),
+        filters=filters,
         limit=10000,
         return_properties=["document_id", "category"]
     )
@@ -229,9 +378,65 @@ def get_user_stats(client: weaviate.WeaviateClient, collection_name: str, user_i
 # GROQ SERVICE
 # ==============================================================================
 
-def generate_resume_from_context(groq_client, relevant_chunks, job_description):
-    # Build a concise context from the most relevant chunks
-    context_parts = []
+LLM_MODEL = "openai/gpt-oss-20b"
+DIGEST_REFINE_MAX_CHARS = 12000
+DIGEST_REFINE_ANSWER_TOKENS = 1024
+
+def refine_digest_with_llm(groq_client, text, digest, reasoning_tokens=2048):
+    """Ask the LLM to correct the locally parsed digest; fall back to it on any failure"""
+    prompt = f"""
+You are cleaning up a structured digest extracted from a candidate's document.
+Correct and complete the "Parsed Digest" using ONLY the "Document Text". Do not invent information.
+Keep every list short and factual. Your entire output must be a single, valid JSON object
+with exactly the keys "roles", "dates", "skills" and "projects", each a list of strings.
+
+**Parsed Digest:**
+{json.dumps(digest)}
+
+**Document Text:**
+---
+{text[:DIGEST_REFINE_MAX_CHARS]}
+---
+"""
+    try:
+        completion = groq_client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            # Reasoning tokens count against max_tokens, so budget for them on top of the answer
+            max_tokens=DIGEST_REFINE_ANSWER_TOKENS + reasoning_tokens,
+            response_format={"type": "json_object"}
+        )
+        if completion.choices[0].finish_reason == "length":
+            print(f"Digest refinement was truncated at {DIGEST_REFINE_ANSWER_TOKENS + reasoning_tokens} tokens, "
+                  f"keeping local digest; consider raising LLM_REASONING_TOKENS")
+            return digest
+        refined = json.loads(completion.choices[0].message.content)
+        if not isinstance(refined, dict):
+            raise ValueError("expected a JSON object")
+    except Exception as e:
+        print(f"Digest refinement failed, keeping local digest: {e}")
+        return digest
+
+    result = {}
+    for field, local_values in digest.items():
+        values = refined.get(field)
+        if isinstance(values, list):
+            result[field] = [str(v) for v in values if v][:DIGEST_LIMITS[field]]
+        else:
+            result[field] = local_values
+    return result
+
+def generate_resume_from_context(groq_client, relevant_chunks, job_description, digests=None,
+                                 template_version=DEFAULT_TEMPLATE_VERSION, assignment="ab",
+                                 min_completion_tokens=1536, reasoning_tokens=2048,
+                                 max_completion_tokens=8192, context_window=131072, record_usage=None):
+    """Generate a resume; returns (resume_json, usage) where usage is a per-request token record.
+
+    record_usage, if given, is called with the usage record whether or not generation succeeds.
+    """
+    # Build a concise context: per-document digests first, then the most relevant chunks
+    context_parts = [format_digest(d["filename"], d["digest"]) for d in (digests or [])]
     seen_content = set()
     for chunk in relevant_chunks:
         # Only include highly relevant chunks and avoid duplicates
@@ -243,52 +448,58 @@ def generate_resume_from_context(groq_client, relevant_chunks, job_description):
     if not context:
         raise ValueError("No sufficiently relevant content found.")
 
-    prompt = f"""
-You are a professional resume writer creating an ATS-optimized resume in JSON format.
-Use ONLY the provided "Candidate Data" to fill out the JSON structure. Do not invent information.
-Tailor the content to the "Target Job Description". If no data exists for a field, use an empty string or array.
-Your entire output must be a single, valid JSON object.
-
-**Candidate Data:**
----
-{context}
----
+    messages = build_resume_messages(template_version, context, job_description)
+    prompt_tokens = count_message_tokens(messages)
+    max_tokens = completion_budget(
+        prompt_tokens, count_tokens(context), min_completion_tokens + reasoning_tokens,
+        max_completion_tokens, context_window
+    )
 
-**Target Job Description:**
----
-{job_description}
----
+    usage = {
+        "template_version": template_version,
+        "assignment": assignment,
+        "model": LLM_MODEL,
+        "status": "error",
+        "attempts": 0,
+        "estimated_prompt_tokens": prompt_tokens,
+        "max_tokens": max_tokens,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cached_prompt_tokens": 0,
+        "latency_ms": 0.0
+    }
+    started = time.perf_counter()
+    try:
+        while True:
+            usage["attempts"] += 1
+            completion = groq_client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                temperature=0.5,
+                max_tokens=max_tokens,
+                response_format={"type": "json_object"}
+            )
+            reported = getattr(completion, "usage", None)
+            prompt_details = getattr(reported, "prompt_tokens_details", None)
+            usage["prompt_tokens"] += getattr(reported, "prompt_tokens", None) or prompt_tokens
+            usage["completion_tokens"] += getattr(reported, "completion_tokens", None) or 0
+            usage["cached_prompt_tokens"] += getattr(prompt_details, "cached_tokens", None) or 0
 
-**Required JSON Output Structure:**
-{{
-  "SUMMARY": "A 2-3 sentence professional summary.",
-  "SKILLS": {{
-    "Languages": "Comma-separated list.", "AI_ML": "Comma-separated list.", "Tools": "Comma-separated list.",
-    "Database": "Comma-separated list.", "Cloud": "Comma-separated list.", "Web_Development": "Comma-separated list.",
-    "Certifications": "Comma-separated list."
-  }},
-  "WORK_EXPERIENCE": [{{
-      "Company": "Company Name", "Location": "City, State", "Title": "Job Title",
-      "Dates": "Month Year - Month Year", "Bullets": ["Achievement-focused bullet point."]
-  }}],
-  "EDUCATION": [{{
-      "Degree": "Degree and Major", "University": "University Name",
-      "Relevant_Courses": ["Course 1"], "GPA": "X.X/4.0", "Dates": "Month Year"
-  }}],
-  "PROJECTS": [{{
-      "Name": "Project Name", "Technologies": "Comma-separated list.",
-      "Bullets": ["Description of project."], "Live_Demo": "URL"
-  }}]
-}}
-"""
-    completion = groq_client.chat.completions.create(
-        model="openai/gpt-oss-20b",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.5,
-        max_tokens=4096,
-        response_format={"type": "json_object"}
-    )
-    
-    response_content = completion.choices[0].message.content
-    return json.loads(response_content)
+            # Reasoning tokens count against max_tokens; retry a truncated answer once at the cap
+            retry_budget = min(max_completion_tokens, context_window - prompt_tokens)
+            if completion.choices[0].finish_reason == "length" and usage["attempts"] == 1 and retry_budget > max_tokens:
+                max_tokens = usage["max_tokens"] = retry_budget
+                continue
+            break
 
+        if completion.choices[0].finish_reason == "length":
+            usage["status"] = "truncated"
+            raise ValueError("The model response was truncated before the resume JSON was complete.")
+        resume_json = json.loads(completion.choices[0].message.content)
+        usage["status"] = "ok"
+        return resume_json, usage
+    finally:
+        usage["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        usage["recorded_at"] = datetime.now().isoformat()
+        if record_usage is not None:
+            record_usage(usage)
@@ -0,0 +1,150 @@
+import fcntl
+import os
+import re
+import threading
+import time
+
+from .services import load_tombstones, remove_tombstone, compact_document
+
+# ==============================================================================
+# TOMBSTONE REGISTRY
+# ==============================================================================
+
+class TombstoneSet:
+    """Thread-safe in-memory view of deleted-but-not-yet-compacted documents"""
+
+    def __init__(self, tombstones=None):
+        self._lock = threading.Lock()
+        self._by_user = {user_id: set(doc_ids) for user_id, doc_ids in (tombstones or {}).items()}
+        # (added_at, user_id, document_id) for local adds a concurrent reload may not have seen yet
+        self._recent_adds = []
+
+    def add(self, user_id, document_id):
+        with self._lock:
+            self._by_user.setdefault(user_id, set()).add(document_id)
+            self._recent_adds.append((time.monotonic(), user_id, document_id))
+
+    def discard(self, user_id, document_id):
+        with self._lock:
+            doc_ids = self._by_user.get(user_id)
+            if doc_ids is not None:
+                doc_ids.discard(document_id)
+                if not doc_ids:
+                    del self._by_user[user_id]
+
+    def refresh(self, loader):
+        """Reload from the store, keeping local adds made while the load was in flight"""
+        started = time.monotonic()
+        tombstones = loader()
+        with self._lock:
+            self._recent_adds = [entry for entry in self._recent_adds if entry[0] >= started]
+            merged = {user_id: set(doc_ids) for user_id, doc_ids in tombstones.items()}
+            for _, user_id, document_id in self._recent_adds:
+                merged.setdefault(user_id, set()).add(document_id)
+            self._by_user = merged
+
+    def for_user(self, user_id):
+        with self._lock:
+            return frozenset(self._by_user.get(user_id, ()))
+
+    def contains(self, user_id, document_id):
+        with self._lock:
+            return document_id in self._by_user.get(user_id, ())
+
+    def items(self):
+        with self._lock:
+            return [(user_id, doc_id) for user_id, doc_ids in self._by_user.items() for doc_id in doc_ids]
+
+# ==============================================================================
+# BACKGROUND WORKERS
+# ==============================================================================
+
+COMPACTOR_LOCK_FILE = ".compactor.lock"
+# Upload route temp files are named f"{user_id}_{filename}"; user_ids are 16 hex chars (see add_user)
+UPLOAD_FILE_PATTERN = re.compile(r'^[0-9a-f]{16}_.+')
+
+def start_tombstone_refresher(client, tombstones, collection_name, interval):
+    """Keep this process's TombstoneSet in sync with deletes handled by other workers"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                tombstones.refresh(lambda: load_tombstones(client, collection_name))
+            except Exception as e:
+                print(f"Tombstone refresh failed: {e}")
+
+    thread = threading.Thread(target=run, name="tombstone-refresher", daemon=True)
+    thread.start()
+    return thread
+
+def acquire_compactor_lease(upload_folder):
+    """Take a non-blocking exclusive lock so only one process per host compacts; None if held elsewhere"""
+    lock_file = open(os.path.join(upload_folder, COMPACTOR_LOCK_FILE), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def cleanup_orphaned_uploads(upload_folder, max_age):
+    """Remove upload files left behind by crashed requests; returns the number removed.
+
+    Only files named like the upload route's temp files are touched, so unrelated
+    files in UPLOAD_FOLDER are never deleted.
+    """
+    removed = 0
+    cutoff = time.time() - max_age
+    for entry in os.scandir(upload_folder):
+        if not UPLOAD_FILE_PATTERN.match(entry.name):
+            continue
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+def compact_once(client, tombstones, config):
+    """Run one compaction pass over every pending tombstone"""
+    for user_id, document_id in tombstones.items():
+        try:
+            deleted = compact_document(
+                client=client,
+                collection_name=config['DOCUMENT_COLLECTION'],
+                user_id=user_id,
+                document_id=document_id,
+                batch_size=config['COMPACTION_BATCH_SIZE'],
+                batch_pause=config['COMPACTION_BATCH_PAUSE'],
+                digest_collection_name=config['DIGEST_COLLECTION']
+            )
+            remove_tombstone(client, config['TOMBSTONE_COLLECTION'], user_id, document_id)
+            tombstones.discard(user_id, document_id)
+            print(f"Compacted document {document_id}: {deleted} chunks deleted")
+        except Exception as e:
+            print(f"Compaction of document {document_id} failed, will retry: {e}")
+
+    removed = cleanup_orphaned_uploads(config['UPLOAD_FOLDER'], config['ORPHAN_UPLOAD_MAX_AGE'])
+    if removed:
+        print(f"Removed {removed} orphaned upload file(s)")
+
+def start_compactor(client, tombstones, config):
+    """Start the daemon thread that physically deletes tombstoned documents"""
+    def run():
+        # The lease is held for the life of the process; the OS releases it if we die
+        lease = None
+        while True:
+            time.sleep(config['COMPACTION_INTERVAL'])
+            if lease is None:
+                lease = acquire_compactor_lease(config['UPLOAD_FOLDER'])
+                if lease is None:
+                    continue
+            try:
+                compact_once(client, tombstones, config)
+            except Exception as e:
+                print(f"Compaction pass failed: {e}")
+
+    thread = threading.Thread(target=run, name="document-compactor", daemon=True)
+    thread.start()
+    return thread
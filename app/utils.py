@@ -1,3 +1,5 @@
+import re
+
 def allowed_file(filename, allowed_extensions):
     """Check if file extension is allowed"""
     return '.' in filename and \
@@ -45,3 +47,82 @@ def categorize_content(content):
     if max(scores.values()) > 0:
         return max(scores, key=scores.get)
     return 'general'
+
+# ==================== DOCUMENT DIGESTS ====================
+
+MONTH_PATTERN = r'(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?'
+DATE_PATTERN = re.compile(
+    rf'\b(?:{MONTH_PATTERN}\s+)?(?:19|20)\d{{2}}'
+    rf'(?:\s*(?:-|–|—|to)\s*(?:(?:{MONTH_PATTERN}\s+)?(?:19|20)\d{{2}}|present|current|now))?',
+    re.IGNORECASE
+)
+ROLE_KEYWORDS = [
+    'engineer', 'developer', 'manager', 'analyst', 'scientist', 'intern', 'architect',
+    'consultant', 'designer', 'lead', 'director', 'administrator', 'specialist', 'researcher'
+]
+SKILL_LABELS = ['skills', 'technologies', 'tech stack', 'languages', 'tools', 'frameworks']
+KNOWN_SKILLS = [
+    'python', 'java', 'javascript', 'typescript', 'c++', 'c#', 'golang', 'rust', 'sql',
+    'react', 'node.js', 'flask', 'django', 'fastapi', 'spring', 'tensorflow', 'pytorch',
+    'scikit-learn', 'pandas', 'numpy', 'docker', 'kubernetes', 'aws', 'azure', 'gcp',
+    'postgresql', 'mysql', 'mongodb', 'redis', 'git', 'linux', 'machine learning',
+    'deep learning', 'nlp', 'spark', 'kafka', 'terraform'
+]
+DIGEST_LIMITS = {'roles': 10, 'dates': 20, 'skills': 40, 'projects': 10}
+
+def _unique(items, limit):
+    """Deduplicate case-insensitively while keeping the original order"""
+    seen = set()
+    result = []
+    for item in items:
+        key = item.lower()
+        if item and key not in seen:
+            seen.add(key)
+            result.append(item)
+        if len(result) >= limit:
+            break
+    return result
+
+def extract_document_digest(text):
+    """Build a compact structured digest (roles, dates, skills, projects) from raw text"""
+    roles, dates, skills, projects = [], [], [], []
+    lines = [line.strip(' \t-•*') for line in text.splitlines()]
+
+    for line in lines:
+        if not line:
+            continue
+        line_lower = line.lower()
+        line_dates = [m.group(0) for m in DATE_PATTERN.finditer(line)]
+        dates.extend(line_dates)
+
+        label, sep, rest = line.partition(':')
+        label_lower = label.strip().lower()
+        if sep and any(label_lower.endswith(skill_label) for skill_label in SKILL_LABELS):
+            skills.extend(s.strip(' .') for s in re.split(r'[,;|]', rest) if s.strip(' .'))
+        elif sep and 'project' in label_lower and len(label) <= 80:
+            projects.append(label.strip())
+        elif len(line) <= 120 and any(re.search(rf'\b{kw}\b', line_lower) for kw in ROLE_KEYWORDS):
+            roles.append(line)
+
+    text_lower = text.lower()
+    skills.extend(
+        skill for skill in KNOWN_SKILLS
+        if re.search(rf'(?<![\w+#.]){re.escape(skill)}(?![\w+#])', text_lower)
+    )
+
+    return {
+        'roles': _unique(roles, DIGEST_LIMITS['roles']),
+        'dates': _unique(dates, DIGEST_LIMITS['dates']),
+        'skills': _unique(skills, DIGEST_LIMITS['skills']),
+        'projects': _unique(projects, DIGEST_LIMITS['projects'])
+    }
+
+def format_digest(filename, digest):
+    """Render a digest as a few compact prompt lines"""
+    lines = [f"[{filename}]"]
+    for field in ('roles', 'dates', 'skills', 'projects'):
+        values = digest.get(field) or []
+        if values:
+            separator = ', ' if field in ('skills', 'dates') else '; '
+            lines.append(f"  {field.capitalize()}: {separator.join(values)}")
+    return "\n".join(lines)
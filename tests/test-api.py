@@ -49,6 +49,22 @@ def test_complete_flow():
     assert response.status_code == 201, "Registration failed"
     print("✓ Registration successful.")
 
+    print("\n1b. Logging in with a bearer token...")
+    response = requests.post(f"{BASE_URL}/login", json={"email": user_email})
+    assert response.status_code == 200, "Login failed"
+    access_token = response.json().get("access_token")
+    assert access_token, "Login did not return an access_token"
+    user_id = response.json()["user_id"]
+
+    # A fresh session carries no cookie, so every following request authenticates via the token
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {access_token}"
+    response = session.get(f"{BASE_URL}/current-user")
+    assert response.status_code == 200 and response.json()["user_id"] == user_id, "Bearer token rejected"
+    response = requests.get(f"{BASE_URL}/current-user", headers={"Authorization": f"Bearer {access_token}x"})
+    assert response.status_code == 401, "Tampered bearer token was accepted"
+    print("✓ Bearer token authentication works.")
+
     print("\n2. Uploading documents...")
     documents = ["sample_resume.txt", "projects.txt", "certifications.txt", "education.txt"]
     for filename in documents:
@@ -57,6 +73,8 @@ def test_complete_flow():
             response = session.post(f"{BASE_URL}/upload-document", files=files)
             print(f"  - Uploaded {filename}: Status {response.status_code}")
             assert response.status_code == 201, f"Upload failed for {filename}"
+            # Requires the default DIGEST_MODE=local (or llm) on the server
+            assert response.json().get("digest_created") is True, f"No digest created for {filename}"
     print("✓ All documents uploaded.")
 
     print("\n3. Checking user stats...")
@@ -80,6 +98,30 @@ def test_complete_flow():
         print(f"Error: {response.json()}")
     
     assert response.status_code == 200, "Resume generation failed"
+    metadata = response.json()["metadata"]
+    assert metadata["digests_used"] > 0, "Resume generation did not use document digests"
+    assert metadata["template_version"] in ("v1", "v2"), f"Unknown template version: {metadata['template_version']}"
+    assert metadata["usage"]["status"] == "ok", f"Unexpected usage status: {metadata['usage']['status']}"
+    assert metadata["usage"]["prompt_tokens"] > 0, "Prompt token usage was not recorded"
+
+    print("\n4b. Deleting a document...")
+    response = session.get(f"{BASE_URL}/my-documents")
+    assert response.status_code == 200, "Failed to list documents"
+    doc = next(d for d in response.json()["documents"] if d["filename"] == "certifications.txt")
+    response = session.delete(f"{BASE_URL}/delete-document/{doc['document_id']}")
+    assert response.status_code == 202, f"Delete was not accepted: {response.status_code}"
+
+    # The tombstone hides the document right away, before the compactor deletes it
+    response = session.get(f"{BASE_URL}/my-documents")
+    listed_ids = {d["document_id"] for d in response.json()["documents"]}
+    assert doc["document_id"] not in listed_ids, "Deleted document is still listed"
+    response = session.post(f"{BASE_URL}/search-my-documents", json={"query": "AWS Solutions Architect certification"})
+    assert response.status_code == 200, "Search failed"
+    assert all(r["document_id"] != doc["document_id"] for r in response.json()["results"]), \
+        "Deleted document still appears in search results"
+    response = session.delete(f"{BASE_URL}/delete-document/{doc['document_id']}")
+    assert response.status_code == 404, "Deleting a tombstoned document twice should return 404"
+    print("✓ Deleted document is hidden immediately.")
 
     print("\n5. Logging out...")
     response = session.post(f"{BASE_URL}/logout")